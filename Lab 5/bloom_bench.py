@@ -0,0 +1,201 @@
+# Benchmarks for the BloomFilter class in lab5.py
+#
+# Run from the Lab 5 folder:  python bloom_bench.py [--json results.json] [--check]
+# Importing lab5 runs the lab script, so its printed output appears first.
+#
+# For each filter configuration in the (size, p, hash scheme, layout) grid this measures build and
+# query throughput, scalar lookup latency percentiles, bytes per key, fill ratio, and the empirical
+# false positive rate next to the theoretical (1 - e^{-kn/m})^k. The lab's websites.csv/queries.pkl
+# are one dataset; synthetic key sets of any size (e.g. --sizes 1e6 1e8) are the others. Synthetic
+# keys are generated and inserted in batches, so a 10^8 key build only holds the filter in memory.
+
+import argparse
+import csv
+import hashlib as hl
+import json
+import pickle as pkl
+import platform
+import time as tm
+
+import numpy as np
+
+from lab5 import BloomFilter, HASH_SCHEMES
+
+
+#The index computation BloomFilter used before double hashing: six cryptographic digests per key,
+#each turned into a big int through its hex string, whatever the value of k
+def legacy_hashes(website, m):
+    h1 = int(hl.md5(website.encode('utf8')).hexdigest(),base=16)%m
+    h2 = int(hl.sha1(website.encode('utf8')).hexdigest(),base=16)%m
+    h3 = int(hl.sha224(website.encode('utf8')).hexdigest(),base=16)%m
+    h4 = int(hl.sha256(website.encode('utf8')).hexdigest(),base=16)%m
+    h5 = int(hl.sha384(website.encode('utf8')).hexdigest(),base=16)%m
+    h6 = int(hl.sha512(website.encode('utf8')).hexdigest(),base=16)%m
+    return (h1,h2,h3,h4,h5,h6)
+
+
+#Reads the website names from the lab's csv file
+def load_websites(filename='websites.csv'):
+    with open(filename, newline='') as f:
+        return [row[0] for row in csv.reader(f) if row]
+
+
+#Returns the best of `repeat` runs of the mean time per key of f over keys, in nanoseconds
+def _time_per_key(f, keys, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = tm.perf_counter()
+        for key in keys:
+            f(key)
+        best = min(best, tm.perf_counter() - start)
+    return best/len(keys)*1e9
+
+
+#Times the per-key cost of computing the k indexes, legacy digests against each double hashing scheme
+def bench_hashing(keys, n, ps=(0.15, 0.01, 1e-4, 1e-6), repeat=5):
+    rows = []
+    for p in ps:
+        m = BloomFilter(n, p).m
+        rows.append({'p': p, 'scheme': 'legacy', 'k': min(BloomFilter(n, p).k, 6),
+                     'ns_per_key': _time_per_key(lambda w: legacy_hashes(w, m), keys, repeat)})
+        for scheme in sorted(HASH_SCHEMES):
+            bf = BloomFilter(n, p, hash_scheme=scheme)
+            rows.append({'p': p, 'scheme': scheme, 'k': bf.k,
+                         'ns_per_key': _time_per_key(bf.__hashes__, keys, repeat)})
+    return rows
+
+
+#A dataset is (name, number of members, function yielding the members in batches,
+#list of queries, boolean array telling which queries are members)
+def lab_dataset(websites='websites.csv', queries='queries.pkl'):
+    members = load_websites(websites)
+    with open(queries, 'rb') as f:
+        q = list(pkl.load(f))
+    truth = np.isin(np.array(q), np.array(members))
+    return 'lab', len(members), lambda batch: [members], q, truth
+
+
+#Synthetic dataset of n distinct member keys; the queries are n_queries keys that are not members
+def synthetic_dataset(n, n_queries, batch=1<<18):
+    def batches(batch=batch):
+        for s in range(0, n, batch):
+            yield ['member-%d' % i for i in range(s, min(s + batch, n))]
+    q = ['query-%d' % i for i in range(n_queries)]
+    return 'synthetic-%d' % n, n, batches, q, np.zeros(n_queries, dtype=bool)
+
+
+#Builds and measures one filter configuration on a dataset, returning a dict of results
+def bench_filter(dataset, p, scheme, blocked, latency_samples=10000):
+    name, n, batches, queries, truth = dataset
+    bf = BloomFilter(n, p, hash_scheme=scheme, blocked=blocked)
+
+    start = tm.perf_counter()
+    for batch in batches(1<<18):
+        bf.update_many(batch)
+    build_s = tm.perf_counter() - start
+
+    start = tm.perf_counter()
+    positive = bf.contains_many(queries)
+    query_s = tm.perf_counter() - start
+
+    sample = queries[:latency_samples]
+    latency = np.empty(len(sample))
+    for i, w in enumerate(sample):
+        t = tm.perf_counter_ns()
+        bf.contains(w)
+        latency[i] = tm.perf_counter_ns() - t
+
+    bf.enable_stats()  # Counted separately so the timings above are uninstrumented
+    for w in sample:
+        bf.contains(w)
+    stats = bf.stats_summary()
+    bf.disable_stats()
+
+    negatives = ~truth
+    return {
+        'dataset': name, 'n': n, 'p': p, 'hash_scheme': scheme, 'layout': 'blocked' if blocked else 'standard',
+        'm': bf.m, 'k': bf.k, 'bytes_per_key': bf.bf.nbytes/n, 'fill_ratio': bf.fill_ratio(),
+        'build_keys_per_s': n/build_s, 'query_keys_per_s': len(queries)/query_s,
+        'latency_ns': {'p50': float(np.percentile(latency, 50)), 'p90': float(np.percentile(latency, 90)),
+                       'p99': float(np.percentile(latency, 99)), 'max': float(latency.max())},
+        'queries': len(queries), 'negatives': int(negatives.sum()),
+        'false_positives': int(np.sum(positive & negatives)),
+        'false_negatives': int(np.sum(~positive & truth)),  # always 0 for a Bloom filter
+        'empirical_fpr': float(np.sum(positive & negatives)/max(negatives.sum(), 1)),
+        'theoretical_fpr': float(bf.theoretical_fpr()),
+        'hash_ns_per_key': stats['hash_ns_per_input'], 'probes_per_lookup': stats['probes_per_lookup'],
+        'early_exit_rate': stats['early_exit_rate'],
+    }
+
+
+#Checks that blocked filters are sized within budget down to small p (bloom_bench.py --check)
+def check_blocked_sizing(n=1000, ps=(1e-4, 1e-7, 3e-8, 1e-8, 1e-12)):
+    for p in ps:
+        bf = BloomFilter(n, p, blocked=True)
+        assert bf.theoretical_fpr() <= p, (p, bf.m, bf.k)
+        assert bf.m <= 4*BloomFilter(n, p).m + 512, (p, bf.m)
+    try:
+        BloomFilter(n, 1e-20, blocked=True)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('p=1e-20 should be rejected for the blocked layout')
+    print('blocked sizing ok for p in %s' % (ps,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bloom filter benchmarks')
+    parser.add_argument('--websites', default='websites.csv')
+    parser.add_argument('--queries', default='queries.pkl')
+    parser.add_argument('--sizes', type=float, nargs='*', default=[1e4, 1e5, 1e6],
+                        help='numbers of keys of the synthetic datasets, up to 1e8')
+    parser.add_argument('--n-queries', type=int, default=100000, help='queries per synthetic dataset')
+    parser.add_argument('--ps', type=float, nargs='+', default=[0.15, 0.01, 0.001])
+    parser.add_argument('--schemes', nargs='+', default=sorted(HASH_SCHEMES), choices=sorted(HASH_SCHEMES))
+    parser.add_argument('--layouts', nargs='+', default=['standard', 'blocked'], choices=['standard', 'blocked'])
+    parser.add_argument('--latency-samples', type=int, default=10000)
+    parser.add_argument('--hashing', action='store_true', help='also time legacy vs double hashing per key')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of the hashing benchmark')
+    parser.add_argument('--json', help='file to write the results to as JSON')
+    parser.add_argument('--check', action='store_true', help='only run the sizing checks and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        check_blocked_sizing()
+        return
+
+    datasets = [lab_dataset(args.websites, args.queries)]
+    datasets += [synthetic_dataset(int(n), args.n_queries) for n in args.sizes]
+    results = []
+    print('\n%-18s %-6s %-8s %-8s %3s %7s %5s %10s %10s %7s %7s %9s %9s' % (
+        'dataset', 'p', 'scheme', 'layout', 'k', 'B/key', 'fill', 'build/s', 'query/s',
+        'p50 ns', 'p99 ns', 'fpr', 'theory'))
+    for dataset in datasets:
+        for p in args.ps:
+            for scheme in args.schemes:
+                for layout in args.layouts:
+                    r = bench_filter(dataset, p, scheme, layout == 'blocked', args.latency_samples)
+                    results.append(r)
+                    print('%-18s %-6g %-8s %-8s %3d %7.2f %5.3f %10.0f %10.0f %7.0f %7.0f %9.5f %9.5f' % (
+                        r['dataset'], r['p'], r['hash_scheme'], r['layout'], r['k'], r['bytes_per_key'],
+                        r['fill_ratio'], r['build_keys_per_s'], r['query_keys_per_s'],
+                        r['latency_ns']['p50'], r['latency_ns']['p99'], r['empirical_fpr'], r['theoretical_fpr']))
+
+    hashing = []
+    if args.hashing:
+        keys = load_websites(args.websites)
+        hashing = bench_hashing(keys, len(keys), repeat=args.repeat)
+        print('\nHashing cost per key (%d keys)' % len(keys))
+        print('%-8s %-8s %3s %12s' % ('p', 'scheme', 'k', 'ns/key'))
+        for row in hashing:
+            print('%-8g %-8s %3d %12.0f' % (row['p'], row['scheme'], row['k'], row['ns_per_key']))
+
+    if args.json:
+        report = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                  'time': tm.strftime('%Y-%m-%dT%H:%M:%S'), 'filters': results, 'hashing': hashing}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,9 +10,20 @@ import scipy as sp
 import csv as csv
 import pickle as pkl
 import hashlib as hl
+import struct as struct
+import zlib as zlib
+import heapq as hq
+import glob as glob
+import collections as collections
+import os as os
+import itertools as it
+import concurrent.futures as cf
+import multiprocessing as mp
+import queue as queue
 import time as tm
 import string as sn
 import scipy.stats as st
+import scipy.special as sps
 print ("Modules Imported!")
 
 
@@ -119,45 +130,484 @@ print ('Is cats.com malicious?', contains('cats.com',bf))
 
 class BloomFilter:
     #Constructor initializes the array and relevant values
-    def __init__(self,n,p):
-        self.n = n     #Number of elements we anticipate putting into the filter
+    #With blocked=True the first hash picks one 512-bit (64 byte, one cache line) block and all k
+    #bits of an input are set inside it, so a lookup touches a single cache line.
+    def __init__(self,n,p,hash_scheme='blake2b',blocked=False):
+        if hash_scheme not in HASH_SCHEMES:
+            raise ValueError('Unknown hash scheme %r, expected one of %s' % (hash_scheme, sorted(HASH_SCHEMES)))
+        self.n = int(n)  #Number of elements we anticipate putting into the filter (1e3 is accepted as 1000)
         self.p = p     #False positive probability upper bound we'd like to achieve
-        self.m = np.ceil(-self.n*np.log(self.p)/np.log(2)**2)  # optimal number of bits m for array
-                                                               # assuming the optimal k will be used
-        self.k = np.min([np.floor(self.m/self.n*np.log(2)+0.5),6])  # min of optimal number of hash functions k and 6
-        self.bf = np.zeros(int(self.m))
+        self.hash_scheme = hash_scheme  #Name of the 128-bit hash the k indexes are derived from
+        self.blocked = blocked
+        self.m = int(np.ceil(-self.n*np.log(self.p)/np.log(2)**2))  # optimal number of bits m for array
+                                                                    # assuming the optimal k will be used
+        self.k = int(max(np.floor(self.m/self.n*np.log(2)+0.5),1))  # optimal number of hash functions k
+        if blocked:
+            self.m, self.k = _blocked_size(self.n, self.p, self.m)
+        self.bf = _aligned_zeros((self.m+63)//64)  # bit array packed 64 bits to a word
     
     #Updates the array with the given input string
     def update(self,website):
         h = self.__hashes__(website)
         i = 0
         while i<self.k:
-            self.bf[h[i]]=1
+            self.bf[h[i]>>6] |= _BIT[h[i]&63]  # word h//64, bit h%64
             i = i+1
     
-    #Returns a tuple of the indexes of the hash functions (can do a max of 6 hash functions)
+    #Returns a list of the k indexes for the input, derived from one 128-bit hash by double hashing:
+    #the ith index is (h1 + i*h2) mod m, where h1 and h2 are the two 64-bit halves of the hash.
+    #In blocked mode h1 mod the number of blocks picks the block, and the ith offset inside it is the
+    #top 9 bits of h2*_SALTS[i] mod 2^64. Double hashing inside a block this small gives probe patterns
+    #that overlap far more often than random ones, which multiplies the false positive rate.
     def __hashes__(self, website):
-        c = (int)(self.m)
-        h1 = int(hl.md5(website.encode('utf8')).hexdigest(),base=16)%c
-        h2 = int(hl.sha1(website.encode('utf8')).hexdigest(),base=16)%c
-        h3 = int(hl.sha224(website.encode('utf8')).hexdigest(),base=16)%c
-        h4 = int(hl.sha256(website.encode('utf8')).hexdigest(),base=16)%c
-        h5 = int(hl.sha384(website.encode('utf8')).hexdigest(),base=16)%c
-        h6 = int(hl.sha512(website.encode('utf8')).hexdigest(),base=16)%c
-        return (h1,h2,h3,h4,h5,h6)
+        h1, h2 = _hash128(website, self.hash_scheme)
+        if self.blocked:
+            base = h1 % (self.m//_BLOCK_BITS)*_BLOCK_BITS
+            return [base + (((h2*_SALTS[i]) & _MASK64) >> 55) for i in range(self.k)]
+        return [((h1 + i*h2) & _MASK64) % self.m for i in range(self.k)]
     
     #Returns whether its possible that the list contains the input or not
     def contains(self, website):
         i = 0
-        c = 0
         h= self.__hashes__(website)
         while i <self.k:
-            c = c + self.bf[h[i]]
+            if not self.bf[h[i]>>6] & _BIT[h[i]&63]:  # one zero bit is enough to rule the input out
+                return 0
             i = i+1
-        if c==self.k:
-            return 1
-        else:
-            return 0
+        return 1
+    
+    #Updates the array with every string in a list or array of inputs, hashing them batch_size at a time
+    def update_many(self, websites, batch_size=1<<16):
+        for s in range(0, len(websites), batch_size):
+            h = self.__hashes_many__(websites[s:s+batch_size]).ravel()
+            np.bitwise_or.at(self.bf, h>>np.uint64(6), _BIT[h&np.uint64(63)])  # scatter; repeated words are OR'ed together
+    
+    #Returns a boolean array telling for each input whether its possible that the list contains it
+    def contains_many(self, websites, batch_size=1<<16):
+        out = np.empty(len(websites), dtype=bool)
+        for s in range(0, len(websites), batch_size):
+            h = self.__hashes_many__(websites[s:s+batch_size])
+            out[s:s+len(h)] = np.all(self.bf[h>>np.uint64(6)] & _BIT[h&np.uint64(63)], axis=1)  # gather k probes per row
+        return out
+    
+    #Returns the (N, k) matrix whose row i holds the same indexes as __hashes__ of input i
+    def __hashes_many__(self, websites):
+        h = _hash128_many(websites, self.hash_scheme)
+        if self.blocked:
+            base = h[:,:1] % np.uint64(self.m//_BLOCK_BITS) * np.uint64(_BLOCK_BITS)
+            return base + ((h[:,1:]*_SALTS_U64[:self.k]) >> np.uint64(55))
+        i = np.arange(self.k, dtype=np.uint64)
+        return (h[:,:1] + i*h[:,1:]) % np.uint64(self.m)  # uint64 arithmetic wraps mod 2^64 like _MASK64
+    
+    #Returns the number of bits set to one in the array
+    def bit_count(self):
+        return _popcount(self.bf)
+    
+    #Returns the fraction of the m bits that are set to one
+    def fill_ratio(self):
+        return self.bit_count()/self.m
+    
+    #Returns the theoretical false positive probability after n inputs (default: the n the filter was
+    #sized for), (1 - e^{-kn/m})^k, or the blocked layout's probability when blocked
+    def theoretical_fpr(self, n=None):
+        n = self.n if n is None else n
+        if self.blocked:
+            return _blocked_fpr(self.m, n, self.k)
+        return (1 - np.exp(-self.k*n/self.m))**self.k
+    
+    #Starts counting in self.stats the time spent hashing, the probes made by each contains and how
+    #often it stops early. Only this instance switches to the counting versions of the methods, so
+    #filters without stats enabled run exactly the code they would otherwise.
+    def enable_stats(self):
+        self.stats = {'updates': 0, 'lookups': 0, 'probes': 0, 'early_exits': 0, 'hashed': 0, 'hash_ns': 0}
+        self.__hashes__ = self.__timed_hashes__
+        self.__hashes_many__ = self.__timed_hashes_many__
+        self.update = self.__counted_update__
+        self.update_many = self.__counted_update_many__
+        self.contains = self.__counted_contains__
+        self.contains_many = self.__counted_contains_many__
+    
+    #Stops counting and goes back to the uninstrumented methods; self.stats keeps the last counts
+    def disable_stats(self):
+        for name in ('__hashes__', '__hashes_many__', 'update', 'update_many', 'contains', 'contains_many'):
+            self.__dict__.pop(name, None)
+    
+    #Returns the counts in self.stats together with the mean hashing time per input, probes per
+    #lookup and the fraction of lookups that stopped before probing all k bits
+    def stats_summary(self):
+        s = dict(self.stats)
+        s['hash_ns_per_input'] = s['hash_ns']/s['hashed'] if s['hashed'] else 0.0
+        s['probes_per_lookup'] = s['probes']/s['lookups'] if s['lookups'] else 0.0
+        s['early_exit_rate'] = s['early_exits']/s['lookups'] if s['lookups'] else 0.0
+        return s
+    
+    def __timed_hashes__(self, website):
+        start = tm.perf_counter_ns()
+        h = type(self).__hashes__(self, website)
+        self.stats['hash_ns'] += tm.perf_counter_ns() - start
+        self.stats['hashed'] += 1
+        return h
+    
+    def __timed_hashes_many__(self, websites):
+        start = tm.perf_counter_ns()
+        h = type(self).__hashes_many__(self, websites)
+        self.stats['hash_ns'] += tm.perf_counter_ns() - start
+        self.stats['hashed'] += len(h)
+        return h
+    
+    def __counted_update__(self, website):
+        self.stats['updates'] += 1
+        type(self).update(self, website)
+    
+    def __counted_update_many__(self, websites, batch_size=1<<16):
+        self.stats['updates'] += len(websites)
+        type(self).update_many(self, websites, batch_size)
+    
+    #contains, counting the bits probed up to the first zero
+    def __counted_contains__(self, website):
+        self.stats['lookups'] += 1
+        for i, h in enumerate(self.__hashes__(website)):
+            if not self.bf[h>>6] & _BIT[h&63]:
+                self.stats['probes'] += i+1
+                self.stats['early_exits'] += 1
+                return 0
+        self.stats['probes'] += self.k
+        return 1
+    
+    #contains_many probes all k bits of every input
+    def __counted_contains_many__(self, websites, batch_size=1<<16):
+        self.stats['lookups'] += len(websites)
+        self.stats['probes'] += len(websites)*self.k
+        return type(self).contains_many(self, websites, batch_size)
+    
+    #Returns a new filter representing the union of the two sets (word-wise OR)
+    def union(self, other):
+        self.__check_compatible__(other)
+        return self.__like__(np.bitwise_or(self.bf, other.bf, out=_aligned_zeros(len(self.bf))))
+    
+    #Returns a new filter approximating the intersection of the two sets (word-wise AND)
+    def intersection(self, other):
+        self.__check_compatible__(other)
+        return self.__like__(np.bitwise_and(self.bf, other.bf, out=_aligned_zeros(len(self.bf))))
+    
+    #Returns a new filter with the parameters of this one and the bit array bf. Only the data fields are
+    #copied, so counters and instrumented methods set by enable_stats are not shared with the result
+    def __like__(self, bf):
+        out = type(self).__new__(type(self))
+        for name in ('n', 'p', 'hash_scheme', 'blocked', 'm', 'k'):
+            setattr(out, name, getattr(self, name))
+        out.bf = bf
+        return out
+    
+    #ORs the bits of other into this filter in place, so it then represents the union of both sets
+    def merge(self, other):
+        self.__check_compatible__(other)
+        np.bitwise_or(self.bf, other.bf, out=self.bf)
+        return self
+    
+    def __or__(self, other):
+        return self.union(other)
+    
+    def __ior__(self, other):
+        return self.merge(other)
+    
+    def __and__(self, other):
+        return self.intersection(other)
+    
+    #Builds a filter from an iterable of strings in parallel. The input is cut into chunks of chunk_size
+    #that are handed out to the worker processes through a queue. Each worker fills one partial filter
+    #with the same (n, p, hash_scheme, blocked) from all the chunks it takes and returns it once at the
+    #end, so only `workers` bit arrays are sent back and OR'ed together, giving exactly the filter a
+    #serial build would. A large csv file can be streamed in with e.g. (row[0] for row in csv.reader(f)).
+    @classmethod
+    def build_parallel(cls, websites, n, p, hash_scheme='blake2b', blocked=False, workers=None, chunk_size=1<<18):
+        bf = cls(n, p, hash_scheme, blocked)
+        workers = workers or os.cpu_count() or 1
+        ctx = mp.get_context()
+        chunks = ctx.Queue(maxsize=2*workers)  # bounds the chunks waiting in memory
+        with cf.ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                    initializer=_init_shard, initargs=(chunks,)) as pool:
+            shards = [pool.submit(_build_shard, cls, n, p, hash_scheme, blocked) for _ in range(workers)]
+            try:
+                websites = iter(websites)
+                for chunk in iter(lambda: list(it.islice(websites, chunk_size)), []):
+                    _put_chunk(chunks, chunk, shards)
+                for _ in shards:
+                    _put_chunk(chunks, None, shards)  # one end marker per worker
+            except BaseException:
+                # Unblock the workers still waiting for chunks so the pool can shut down
+                while True:
+                    try:
+                        chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                for _ in shards:
+                    try:
+                        chunks.put_nowait(None)
+                    except queue.Full:
+                        break
+                raise
+            for f in cf.as_completed(shards):
+                np.bitwise_or(bf.bf, f.result(), out=bf.bf)
+        return bf
+    
+    #Writes the filter to a file: a fixed size header (see _HEADER) followed by the raw bit array
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.__header__())
+            self.bf.tofile(f)
+    
+    #Opens a filter written by save() without reading it into memory. The bit array is memory-mapped,
+    #so processes opening the same file share its pages through the OS page cache. mode is passed to
+    #np.memmap: 'r' read-only, 'r+' writable (call flush() to save), 'c' copy-on-write in memory only.
+    #verify=True checks the checksum, which reads the whole array.
+    @classmethod
+    def open(cls, path, mode='r', verify=False):
+        if mode not in ('r', 'r+', 'c'):  # 'w+' would truncate the file after its header was read
+            raise ValueError("Unsupported mode %r, expected 'r', 'r+' or 'c'" % (mode,))
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError('%s is too short to be a Bloom filter file' % path)
+        magic, version, flags, n, m, k, p, scheme, crc = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise ValueError('%s is not a Bloom filter file' % path)
+        if version != _VERSION:
+            raise ValueError('%s has unsupported Bloom filter file version %d' % (path, version))
+        self = cls.__new__(cls)
+        self.n = n
+        self.p = p
+        self.hash_scheme = scheme.rstrip(b'\0').decode('ascii')
+        self.blocked = bool(flags & _FLAG_BLOCKED)
+        self.m = m
+        self.k = k
+        self.bf = np.memmap(path, dtype=np.uint64, mode=mode, offset=_HEADER.size, shape=((m+63)//64,))
+        if verify and zlib.crc32(self.bf) != crc:
+            raise ValueError('%s failed its checksum' % path)
+        return self
+    
+    #Writes changes to a filter opened with mode 'r+' back to its file and updates the stored checksum
+    def flush(self):
+        if not isinstance(self.bf, np.memmap) or self.bf.mode != 'r+':
+            raise ValueError('flush() needs a filter opened with mode r+')
+        self.bf.flush()
+        with open(self.bf.filename, 'r+b') as f:
+            f.write(self.__header__())
+    
+    #Returns the file header describing this filter, including the crc32 of its bit array
+    def __header__(self):
+        return _HEADER.pack(_MAGIC, _VERSION, _FLAG_BLOCKED if self.blocked else 0, self.n, self.m, self.k, self.p,
+                            self.hash_scheme.encode('ascii'), zlib.crc32(self.bf))
+    
+    #Filters can only be combined if they map inputs to the same bits
+    def __check_compatible__(self, other):
+        if (self.m != other.m or self.k != other.k or self.hash_scheme != other.hash_scheme
+                or self.blocked != other.blocked):
+            raise ValueError('Bloom filters must have the same m, k, hash scheme and layout to be combined')
+
+_shard_chunks = None  # The queue of chunks in a build_parallel worker process
+
+def _init_shard(chunks):
+    global _shard_chunks
+    _shard_chunks = chunks
+
+#Fills one partial filter for BloomFilter.build_parallel from chunks taken off the queue until the end
+#marker None, and returns its bit array (runs in a worker process)
+def _build_shard(cls, n, p, hash_scheme, blocked):
+    bf = cls(n, p, hash_scheme, blocked)
+    for chunk in iter(_shard_chunks.get, None):
+        bf.update_many(chunk)
+    return bf.bf
+
+#Puts a chunk on the queue for the build_parallel workers, raising the error of any worker that failed
+#instead of waiting forever for room on the queue
+def _put_chunk(chunks, chunk, shards):
+    while True:
+        try:
+            chunks.put(chunk, timeout=0.1)
+            return
+        except queue.Full:
+            for f in shards:
+                if f.done():
+                    f.result()
+
+#128-bit hash functions the filter can be built on; each returns a 16 byte digest
+def _blake2b(data):
+    return hl.blake2b(data, digest_size=16).digest()
+
+def _md5(data):
+    return hl.md5(data).digest()
+
+def _sha1(data):
+    return hl.sha1(data).digest()[:16]  # truncated to 128 bits
+
+HASH_SCHEMES = {'blake2b': _blake2b, 'md5': _md5, 'sha1': _sha1}
+
+_MASK64 = (1<<64)-1
+
+#Returns the two 64-bit halves (h1, h2) of the 128-bit hash of the input string
+def _hash128(website, scheme):
+    d = HASH_SCHEMES[scheme](website.encode('utf8'))
+    return int.from_bytes(d[:8], 'little'), int.from_bytes(d[8:], 'little')
+
+#Returns an (N, 2) uint64 array holding (h1, h2) of _hash128 for each input string
+def _hash128_many(websites, scheme):
+    digest = HASH_SCHEMES[scheme]
+    buf = b''.join([digest(website.encode('utf8')) for website in websites])
+    return np.frombuffer(buf, dtype='<u8').astype(np.uint64, copy=False).reshape(-1, 2)
+
+#Bloom filter file header: magic, format version, flags (_FLAG_BLOCKED), n, m, k, p, hash scheme name,
+#crc32 of the bit array. Padded to 64 bytes so the memory-mapped words that follow are aligned.
+_HEADER = struct.Struct('<4sHHQQId16sI8x')
+_MAGIC = b'BLMF'
+_VERSION = 1
+_FLAG_BLOCKED = 1
+
+_BLOCK_BITS = 512  # bits in one block of a blocked filter, a 64 byte cache line
+
+#Odd 64-bit multipliers giving the probe offsets inside a block, fixed so saved filters stay readable
+_SALTS = [int.from_bytes(hl.blake2b(b'bloom block salt %d' % i, digest_size=8).digest(), 'little') | 1
+          for i in range(_BLOCK_BITS)]
+_SALTS_U64 = np.array(_SALTS, dtype=np.uint64)
+
+#Returns the false positive probability of a blocked filter with m bits. The number of inputs that land
+#in a given block is Poisson with mean n*B/m, and a block holding j inputs is a standard filter of B bits.
+def _blocked_fpr(m, n, k, B=_BLOCK_BITS):
+    lam = n*B/m
+    j = np.arange(int(lam + 12*np.sqrt(lam) + 12))
+    return float(np.sum(st.poisson.pmf(j, lam)*(1 - (1 - 1/B)**(j*k))**k))
+
+_BLOCKED_MAX_K = 64       # Largest number of bits per input searched for a blocked filter
+_BLOCKED_MAX_GROWTH = 4   # Largest ratio of a blocked filter's m to the m of the standard layout
+
+#Returns (false positive probability, k) of a blocked filter with m bits and the k in 1.._BLOCKED_MAX_K
+#that minimizes it. The k = m/n ln 2 of the standard layout overloads the blocks once m/n is large.
+def _blocked_best_k(m, n, B=_BLOCK_BITS):
+    lam = n*B/m
+    j = np.arange(int(lam + 12*np.sqrt(lam) + 12))[:,None]
+    k = np.arange(1, _BLOCKED_MAX_K + 1)
+    fpr = np.sum(st.poisson.pmf(j, lam)*(1 - (1 - 1/B)**(j*k))**k, axis=0)
+    return float(fpr.min()), int(k[np.argmin(fpr)])
+
+#Returns (m, k) of a blocked filter for n inputs with false positive probability at most p, starting
+#from the m of the standard layout. Blocks get unequal numbers of inputs, which raises the false positive
+#probability, so m grows a whole number of blocks at a time; past _BLOCKED_MAX_GROWTH times the standard
+#m the blocks cannot reach p and a ValueError is raised.
+def _blocked_size(n, p, m):
+    m = -(-m//_BLOCK_BITS)*_BLOCK_BITS
+    limit = _BLOCKED_MAX_GROWTH*m
+    fpr, k = _blocked_best_k(m, n)
+    while fpr > p:
+        if m >= limit:
+            raise ValueError('p=%g is below what 512-bit blocks reach with up to %d times the bits of the '
+                             'standard layout, use blocked=False' % (p, _BLOCKED_MAX_GROWTH))
+        m = min(int(np.ceil(m*1.02/_BLOCK_BITS))*_BLOCK_BITS, limit)
+        fpr, k = _blocked_best_k(m, n)
+    return m, k
+
+#Returns a zeroed uint64 array whose data starts on a 64 byte boundary, so that each 512-bit block of a
+#blocked filter is exactly one cache line (np.zeros only guarantees 16 byte alignment)
+def _aligned_zeros(words):
+    buf = np.zeros(words + 8, dtype=np.uint64)
+    start = (-buf.ctypes.data % 64)//8
+    return buf[start:start+words]
+
+_BIT = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))  # _BIT[j] has only bit j set
+_POP8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)  # number of ones in each byte value
+
+#Returns the total number of one bits in an array of uint64 words
+def _popcount(words):
+    if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+    return int(_POP8[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+#A Bloom filter that keeps taking inputs past n without its false positive probability going over p
+#(Almeida et al., Scalable Bloom Filters, 2007). It is a list of BloomFilters: when the newest one
+#holds the number of inputs it was sized for, a new one with growth times the capacity and tightening
+#times the error probability is appended. The ith filter gets p_i = p*(1-tightening)*tightening**i, and since those
+#sum to p, the compounded false positive probability 1 - prod(1-p_i) stays below p however many are added.
+class ScalableBloomFilter:
+    def __init__(self, n, p, hash_scheme='blake2b', blocked=False, growth=2, tightening=0.5):
+        self.n = n     #Capacity of the first filter
+        self.p = p     #Bound on the false positive probability of the whole structure
+        self.hash_scheme = hash_scheme
+        self.blocked = blocked
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+        self.__add_filter__()
+    
+    #Updates the newest filter with the given input string, unless it is already (possibly) present
+    def update(self, website):
+        if self.contains(website):
+            return
+        self.filters[-1].update(website)
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self.__check_fill__()
+    
+    #Returns whether its possible that the list contains the input or not
+    def contains(self, website):
+        for bf in reversed(self.filters):  # the newest filter is the largest
+            if bf.contains(website):
+                return 1
+        return 0
+    
+    #Updates the filters with every string in a list or array of inputs
+    def update_many(self, websites):
+        websites = np.unique(np.asarray(websites))  # repeats within the batch would be counted twice
+        websites = websites[~self.contains_many(websites)]
+        while len(websites):
+            take = max(self._countdown, 1)
+            self.filters[-1].update_many(websites[:take])
+            websites = websites[take:]
+            self._countdown -= take
+            if self._countdown <= 0:
+                self.__check_fill__()
+    
+    #Returns a boolean array telling for each input whether its possible that the list contains it
+    def contains_many(self, websites):
+        out = np.zeros(len(websites), dtype=bool)
+        for bf in self.filters:
+            out |= bf.contains_many(websites)
+        return out
+    
+    #Returns the designed bound on the false positive probability, 1 - prod(1-p_i) over the filters so far
+    def error_bound(self):
+        return 1 - np.prod([1 - bf.p for bf in self.filters])
+    
+    #Returns the false positive probability estimated from how full each filter actually is
+    def fpr(self):
+        return 1 - np.prod([1 - bf.theoretical_fpr(_inputs_from_fill(bf)) for bf in self.filters])
+    
+    #Returns the total number of bits over all filters
+    def bit_size(self):
+        return sum(bf.m for bf in self.filters)
+    
+    #Appends a new filter with a larger capacity and smaller error probability than the last
+    def __add_filter__(self):
+        i = len(self.filters)
+        self.filters.append(BloomFilter(self.n*self.growth**i, self.p*(1-self.tightening)*self.tightening**i,
+                                        self.hash_scheme, self.blocked))
+        self._countdown = 0
+        self.__check_fill__()
+    
+    #Closes the newest filter once the inputs estimated from its fill reach its capacity n, the count
+    #its m and k were sized to keep within p_i in either layout. Otherwise schedules the next check
+    #after half the remaining inputs, so popcounts are rare and the capacity is not overshot by much.
+    def __check_fill__(self):
+        bf = self.filters[-1]
+        headroom = bf.n - _inputs_from_fill(bf)
+        if headroom <= 0:
+            self.__add_filter__()
+            return
+        self._countdown = max(int(headroom/2), 1)
+
+#Returns the number of distinct inputs a filter most likely holds, inverting the expected fill
+#1 - exp(-k*n/m) after n inputs
+def _inputs_from_fill(bf):
+    return -bf.m/bf.k*np.log1p(-bf.fill_ratio())
 
 print ('Class Loaded')
 
@@ -281,43 +731,403 @@ class minHash:
         self.comWords = comWords
         self.load()
     
-    #Attempts to load the file from the given filepath
+    #Loads the file from the given filepath in large chunks and builds its signature (raises OSError if
+    #the file cannot be read)
     def load(self):
         self.signature = self.k*[float('inf')] #Builds a list with k elements equal to infinity
-        translator = str.maketrans('', '', sn.punctuation)
-        try:
-            f = open(self.filename,'r')
-            shingle = self.n*['']  # Initialize to list of n empty strings
-            pointer = 0  # Points to location next word will go into the list shingle, it cycles modulo n
-            full_flag=0  # Indicates whether at least n words have been read yet
-            
-            for line in f:
-                for word in line.split():
-                    word = word.translate(translator) #Removes punctuation
-                    word = word.lower() #Makes lower case
-                    if not (word in self.comWords): 
-                        shingle[pointer] = word
-                        if pointer==self.n-1: full_flag=1   # First happens just after the nth word is added to shingle
-                        pointer = (pointer+1)%self.n
-                        if full_flag==1: self.__updateSig__(shingle, pointer)
-            f.close()
-            
-        except:
-            print ('Error: Could Not Load File')
+        self._heap = [(-float('inf'), i) for i in range(self.k)] #Max-heap of (-value, position in signature); ties
+                                                                 #pop lowest position first, like np.argmax
+        self._members = set() #Hash values currently in the signature
+        for h in iter_shingle_hashes(read_chunks(self.filename), self.n, self.comWords):
+            self.__updateSigHash__(h)
     
     #Determines if the signature should be updated to include the hash value of the new shingle
+    #(shingle is a list of n words read cyclically, with the oldest word at pointer)
     def __updateSig__(self, shingle, pointer):
-        conShing = '' #Will become the string obtained by loading in words, beginning at pointer
-        for i in range(pointer, np.size(shingle)):
-            conShing = conShing + shingle[i]
-        for i in range(pointer):
-            conShing = conShing + shingle[i]
-        h = int(hl.sha1(conShing.encode('utf8')).hexdigest(),base=16) #Hash function used in signature 
-        
-        if h<np.max(self.signature) and not (h in self.signature):  #Add new hash value to signature if it is smaller than the largest already there.
-            i = np.argmax(self.signature) #Makes sure there are no duplicate values in signature
+        self.__updateSigHash__(_shingle_hash(''.join(shingle[pointer:] + shingle[:pointer])))
+    
+    #Adds hash value h to the signature if it is smaller than the largest value there and not already in it
+    def __updateSigHash__(self, h):
+        top, i = self._heap[0] #Largest value in the signature and its position
+        if h < -top and h not in self._members:  #Add new hash value to signature if it is smaller than the largest already there.
+            hq.heapreplace(self._heap, (-h, i)) #Makes sure there are no duplicate values in signature
+            self._members.discard(self.signature[i])
+            self._members.add(h)
             self.signature[i] = h
 
+_PUNCTUATION = str.maketrans('', '', sn.punctuation)
+
+#Yields the text of a file (a path or an open text file) in chunks of chunk_size characters
+def read_chunks(source, chunk_size=1<<20):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'r') as f:
+            yield from iter(lambda: f.read(chunk_size), '')
+    else:
+        yield from iter(lambda: source.read(chunk_size), '')
+
+#Yields, for each piece of text, the list of its words with punctuation removed, in lower case and
+#without the common words. texts is a string or any iterable of strings (e.g. an open file or
+#read_chunks); a word may run across the boundary between two pieces.
+def iter_word_lists(texts, comWords=()):
+    if isinstance(texts, str):
+        texts = (texts,)
+    stop = frozenset(comWords)
+    carry = ''  # A word cut off at the end of the previous piece
+    for text in texts:
+        text = carry + text
+        words = text.split()
+        carry = words.pop() if words and not text[-1].isspace() else ''
+        if words:
+            # Join with single spaces so a whole piece is normalized in two calls; splitting on ' ' again
+            # keeps words made only of punctuation as empty strings, as normalizing word by word would
+            words = ' '.join(words).translate(_PUNCTUATION).lower().split(' ')
+            yield [w for w in words if w not in stop]
+    if carry:
+        yield [w for w in [carry.translate(_PUNCTUATION).lower()] if w not in stop]
+
+#Yields the shingles of a text: each run of n consecutive words (see iter_word_lists) concatenated
+def iter_shingles(texts, n, comWords=()):
+    if n < 1:
+        raise ValueError('Shingles need at least one word, got n=%d' % n)
+    tail = []  # The last n-1 words, which start shingles completed by the next piece
+    for words in iter_word_lists(texts, comWords):
+        words = tail + words
+        yield from map(''.join, zip(*[words[i:] for i in range(n)]))
+        tail = words[max(0, len(words)-n+1):] if n > 1 else []
+
+#Yields the minHash hash value of each shingle of a text
+def iter_shingle_hashes(texts, n, comWords=()):
+    return map(_shingle_hash, iter_shingles(texts, n, comWords))
+
+#Hash function used in minHash signatures: sha1 of the shingle as an integer
+def _shingle_hash(shingle):
+    return int.from_bytes(hl.sha1(shingle.encode('utf8')).digest(), 'big')
+
+
+#Computes minHash signatures for many documents at once as an (N, k) uint64 matrix, one row per
+#document, and compares one signature against all of them in a single vectorized step. Shingles are
+#built as in minHash and hashed to 64 bits with the BloomFilter hash schemes. method is one of:
+#   'bottom-k'  the k smallest shingle hashes in increasing order, as in minHash
+#   'k-perm'    the minimum of each of k random permutations of the hash values
+#   'oph'       one permutation hashing: one permutation whose range is cut into k bins, keeping the
+#               minimum of each bin. Empty bins are then filled with the value of a nonempty bin
+#               picked by a seeded hash of the bin number (densification), the same for every
+#               document, so short documents do not agree on their empty bins
+#Positions no shingle reached hold _EMPTY, which plays the role of float('inf') in minHash.
+class MinHashEngine:
+    METHODS = ('bottom-k', 'k-perm', 'oph')
+    
+    def __init__(self, n, k, comWords=(), method='bottom-k', hash_scheme='blake2b', seed=0):
+        if method not in self.METHODS:
+            raise ValueError('Unknown minHash method %r, expected one of %s' % (method, self.METHODS))
+        if hash_scheme not in HASH_SCHEMES:
+            raise ValueError('Unknown hash scheme %r, expected one of %s' % (hash_scheme, sorted(HASH_SCHEMES)))
+        self.n = n  # Number of words per shingle
+        self.k = k  # Number of values in a signature
+        self.comWords = sorted(set(comWords))
+        self.method = method
+        self.hash_scheme = hash_scheme
+        self.seed = seed
+        # Permutations x -> mix(a*x + b mod 2^64) with odd a, derived from the seed so they are the same
+        # on every machine and NumPy version
+        params = np.array([np.frombuffer(hl.blake2b(b'minhash %d %d' % (seed, i), digest_size=16).digest(), '<u8')
+                           for i in range(k)], dtype=np.uint64).reshape(-1, 2)
+        self._a = params[:,0] | np.uint64(1)
+        self._b = params[:,1]
+        self._dense = np.frombuffer(hl.blake2b(b'minhash densify %d' % seed, digest_size=16).digest(), '<u8')
+    
+    #Returns the sorted array of distinct 64-bit shingle hashes of a document: a file path, or an
+    #iterable of text such as an open file (wrap a string of text in a list)
+    def shingle_hashes(self, doc):
+        texts = read_chunks(doc) if isinstance(doc, (str, os.PathLike)) else doc
+        shingles = list(iter_shingles(texts, self.n, self.comWords))
+        return np.unique(_hash128_many(shingles, self.hash_scheme)[:,0])
+    
+    #Returns the signature of one document (see shingle_hashes) as a length k uint64 array
+    def signature(self, doc):
+        return self.sketch(self.shingle_hashes(doc))
+    
+    #Returns the (N, k) signature matrix of a list of documents
+    def signatures(self, docs):
+        sigs = np.full((len(docs), self.k), _EMPTY, dtype=np.uint64)
+        for i, doc in enumerate(docs):
+            sigs[i] = self.signature(doc)
+        return sigs
+    
+    #Returns the signature of a set of shingle hashes (a sorted uint64 array without repeats)
+    def sketch(self, x):
+        sig = np.full(self.k, _EMPTY, dtype=np.uint64)
+        if self.method == 'bottom-k':
+            sig[:min(len(x), self.k)] = x[:self.k]
+        elif self.method == 'k-perm':
+            step = max(1, (1<<22)//max(self.k, 1))  # hash values per block, bounding the k x block matrix
+            for s in range(0, len(x), step):
+                y = self.__permute__(x[None,s:s+step], self._a[:,None], self._b[:,None])
+                np.minimum(sig, y.min(axis=1), out=sig)
+        else:
+            y = self.__permute__(x, self._a[0], self._b[0])
+            bins = ((y >> np.uint64(32)) * np.uint64(self.k)) >> np.uint64(32)  # bin of the permuted value
+            np.minimum.at(sig, bins.astype(np.intp), y)
+            self.__densify__(sig)
+        return sig
+    
+    #Fills the empty bins of an 'oph' signature in place: empty bin j takes the value of the first
+    #nonempty bin among h(j, 0), h(j, 1), ..., so two documents agree on it with probability about
+    #their Jaccard measure (optimal densification, Shrivastava 2017)
+    def __densify__(self, sig):
+        full = sig != _EMPTY
+        if full.all() or not full.any():
+            return
+        src = sig.copy()
+        todo = np.flatnonzero(~full).astype(np.uint64)
+        a, b = self._dense[0] | np.uint64(1), self._dense[1]
+        t = np.uint64(0)
+        while len(todo):
+            y = self.__permute__((todo << np.uint64(32)) | t, a, b)
+            c = (((y >> np.uint64(32)) * np.uint64(self.k)) >> np.uint64(32)).astype(np.intp)
+            hit = full[c]
+            sig[todo[hit].astype(np.intp)] = src[c[hit]]
+            todo = todo[~hit]
+            t += np.uint64(1)
+    
+    #Returns the estimated Jaccard measure between the document with signature sig and each document
+    #in the (N, k) matrix sigs, as a length N float array
+    def jaccard(self, sig, sigs):
+        sigs = np.atleast_2d(sigs)
+        if self.method == 'bottom-k':
+            # |h_k(A u B) n h_k(A) n h_k(B)| / k: merge each pair of signatures in sorted order, where a
+            # value appearing twice is in both, and keep the k smallest distinct values of the union
+            merged = np.sort(np.concatenate([np.broadcast_to(sig, sigs.shape), sigs], axis=1), axis=1)
+            repeat = merged[:,1:] == merged[:,:-1]
+            first = merged != _EMPTY
+            first[:,1:] &= ~repeat
+            top = first & (np.cumsum(first, axis=1) <= self.k)
+            both = top[:,:-1] & repeat
+            num, den = both.sum(axis=1), top.sum(axis=1)
+        else:
+            # Fraction of positions that agree, over the positions at least one document reached
+            num = ((sigs == sig) & (sigs != _EMPTY)).sum(axis=1)
+            den = ((sigs != _EMPTY) | (sig != _EMPTY)).sum(axis=1)
+        return np.divide(num, den, out=np.zeros(len(sigs)), where=den > 0)
+    
+    #Returns a string naming every setting that affects the signatures, used as part of cache keys
+    def config_key(self):
+        method = 'oph-dense' if self.method == 'oph' else self.method  # not the undensified 'oph' entries
+        return '%s|%d|%d|%s|%s|%d' % (method, self.n, self.k, ' '.join(self.comWords), self.hash_scheme, self.seed)
+    
+    #Permutes 64-bit values: a*x + b mod 2^64 followed by an xor-shift, which are both invertible
+    @staticmethod
+    def __permute__(x, a, b):
+        y = a*x + b
+        return y ^ (y >> np.uint64(32))
+
+_EMPTY = np.iinfo(np.uint64).max
+
+
+#Locality sensitive hashing index over minHash signatures for finding near-duplicate documents without
+#comparing every pair. Each signature is cut into b bands of r values; documents whose signatures agree
+#on every value of some band land in the same bucket of that band and become candidate pairs. Two
+#documents with Jaccard measure s are candidates with probability 1 - (1 - s^r)^b, an S-curve that
+#rises around threshold when (b, r) come from lsh_params. Signatures must be positional, i.e. made by
+#MinHashEngine with method 'k-perm' or 'oph'; bottom-k signatures cannot be banded. Bands holding an
+#empty value (only documents without shingles have them) are not bucketed.
+class LSHIndex:
+    def __init__(self, k, threshold=0.5, bands=None, rows=None):
+        self.k = k
+        self.threshold = threshold
+        if bands is None or rows is None:
+            bands, rows = lsh_params(k, threshold)
+        if bands*rows > k:
+            raise ValueError('%d bands of %d rows need more than the %d values in a signature' % (bands, rows, k))
+        self.bands = bands
+        self.rows = rows
+        self.tables = [{} for _ in range(bands)]  # One dict per band: band bytes -> list of keys
+        self.signatures = {}
+        self.shingles = {}  # Shingle hash arrays of the documents inserted with them, for exact verification
+        self.candidate_count = 0  # Distinct candidate pairs among the inserted documents
+    
+    #Adds a document to the index under key. shingles (its sorted array of distinct shingle hashes, see
+    #MinHashEngine.shingle_hashes) is optional and lets queries verify candidates exactly.
+    def insert(self, key, sig, shingles=None):
+        if key in self.signatures:
+            raise ValueError('Key %r is already in the index' % (key,))
+        self.candidate_count += len(self.query(sig))
+        self.signatures[key] = sig = np.array(sig, dtype=np.uint64)
+        if shingles is not None:
+            self.shingles[key] = shingles
+        for table, band in zip(self.tables, self.__bands__(sig)):
+            if band is not None:
+                table.setdefault(band, []).append(key)
+    
+    #Returns the set of keys sharing at least one band with the signature. With verify=True returns
+    #instead a list of (key, jaccard) for the candidates whose Jaccard measure reaches the threshold,
+    #most similar first: exact if shingles are given here and were given to insert, otherwise estimated
+    #from the signatures.
+    def query(self, sig, shingles=None, verify=False):
+        sig = np.asarray(sig, dtype=np.uint64)
+        candidates = set()
+        for table, band in zip(self.tables, self.__bands__(sig)):
+            if band is not None:
+                candidates.update(table.get(band, ()))
+        if not verify:
+            return candidates
+        scored = [(key, self.__similarity__(sig, shingles, key)) for key in candidates]
+        return sorted([(key, s) for key, s in scored if s >= self.threshold], key=lambda c: -c[1])
+    
+    #Returns the set of candidate pairs (key1, key2) among the inserted documents, in insertion order.
+    #With verify=True returns a list of (key1, key2, jaccard) for the pairs reaching the threshold.
+    def candidate_pairs(self, verify=False):
+        order = {key: i for i, key in enumerate(self.signatures)}
+        pairs = set()
+        for table in self.tables:
+            for keys in table.values():
+                for i in range(len(keys)):
+                    for j in range(i+1, len(keys)):
+                        pairs.add((keys[i], keys[j]) if order[keys[i]] < order[keys[j]] else (keys[j], keys[i]))
+        if not verify:
+            return pairs
+        scored = [(a, b, self.__similarity__(self.signatures[a], self.shingles.get(a), b)) for a, b in pairs]
+        return [c for c in scored if c[2] >= self.threshold]
+    
+    #Returns how much the index cuts down the all-pairs comparison
+    def stats(self):
+        n = len(self.signatures)
+        all_pairs = n*(n-1)//2
+        return {'documents': n, 'bands': self.bands, 'rows': self.rows,
+                'all_pairs': all_pairs, 'candidate_pairs': self.candidate_count,
+                'reduction': 1 - self.candidate_count/all_pairs if all_pairs else 0.0}
+    
+    #Returns the byte strings of the b bands of a signature, used as bucket keys, or None for a band
+    #holding an empty value, which would make every document without shingles a candidate of the others
+    def __bands__(self, sig):
+        sig = np.ascontiguousarray(sig, dtype=np.uint64)
+        r = self.rows
+        return [None if np.any(sig[i*r:(i+1)*r] == _EMPTY) else sig[i*r:(i+1)*r].tobytes()
+                for i in range(self.bands)]
+    
+    #Returns the Jaccard measure between a document and the inserted document key
+    def __similarity__(self, sig, shingles, key):
+        other = self.shingles.get(key)
+        if shingles is not None and other is not None:
+            inter = len(np.intersect1d(shingles, other, assume_unique=True))
+            union = len(shingles) + len(other) - inter
+            return inter/union if union else 0.0
+        other = self.signatures[key]
+        seen = (sig != _EMPTY) | (other != _EMPTY)
+        return float(np.sum((sig == other) & seen)/np.sum(seen)) if seen.any() else 0.0
+
+#On-disk cache of signatures, one .npy file per entry in directory. Entries are keyed by the sha256 of
+#the document's content together with MinHashEngine.config_key(), so a changed file or different settings
+#never hit a stale entry. An in-memory index, loaded from the files' modification times when the cache
+#is opened, keeps the entries in least recently used order; reading an entry also touches its file so
+#the order survives reopening. When the files take more than max_bytes, the least recently used are
+#deleted until they take at most low_water*max_bytes, so a full cache is not trimmed on every put.
+class SignatureCache:
+    def __init__(self, directory, max_bytes=1<<30, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        os.makedirs(directory, exist_ok=True)
+        entries = sorted((os.stat(f).st_mtime_ns, os.path.getsize(f), f)
+                         for f in glob.glob(os.path.join(directory, '*.npy')))
+        self.index = collections.OrderedDict((os.path.basename(f)[:-4], size) for _, size, f in entries)  # key -> bytes, oldest first
+        self.size = sum(self.index.values())
+    
+    #Returns the cache key of a document with the given content hash under an engine's settings
+    @staticmethod
+    def key(content_hash, engine):
+        return hl.sha256(('%s|%s' % (content_hash, engine.config_key())).encode('utf8')).hexdigest()
+    
+    #Returns the cached signature for key, or None
+    def get(self, key):
+        path = self.__path__(key)
+        try:
+            sig = np.load(path)
+        except FileNotFoundError:
+            self.__forget__(key)
+            return None
+        os.utime(path)  # the modification time records the last use
+        if key not in self.index:  # written by another process
+            self.index[key] = os.path.getsize(path)
+            self.size += self.index[key]
+        self.index.move_to_end(key)
+        return sig
+    
+    #Stores a signature under key, then evicts least recently used entries if over max_bytes
+    def put(self, key, sig):
+        path = self.__path__(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, sig)
+        os.replace(tmp, path)  # atomic, so readers never see a partial entry
+        self.__forget__(key)
+        self.index[key] = os.path.getsize(path)
+        self.size += self.index[key]
+        if self.size > self.max_bytes:
+            self.evict()
+    
+    #Deletes entries, least recently used first, until the cache takes at most low_water*max_bytes
+    def evict(self):
+        while self.index and self.size > self.low_water*self.max_bytes:
+            key, size = self.index.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.__path__(key))
+            except FileNotFoundError:
+                pass
+    
+    def __forget__(self, key):
+        self.size -= self.index.pop(key, 0)
+    
+    def __path__(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+#Returns the sha256 hex digest of a file's content
+def file_hash(path, chunk_size=1<<20):
+    h = hl.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+#Fingerprints every file matching pattern in directory and returns (paths, signatures), the sorted list
+#of paths and their (N, k) signature matrix. Signatures found in the cache are reused, and only new or
+#changed files are shingled, in parallel over a pool of worker processes.
+def fingerprint_corpus(directory, engine, cache=None, pattern='*.txt', workers=None):
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    sigs = np.full((len(paths), engine.k), _EMPTY, dtype=np.uint64)
+    keys = [SignatureCache.key(file_hash(path), engine) for path in paths]
+    todo = []
+    for i, key in enumerate(keys):
+        sig = cache.get(key) if cache is not None else None
+        if sig is None:
+            todo.append(i)
+        else:
+            sigs[i] = sig
+    if todo:
+        with cf.ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, sig in zip(todo, pool.map(engine.signature, [paths[i] for i in todo])):
+                sigs[i] = sig
+                if cache is not None:
+                    cache.put(keys[i], sig)
+    return paths, sigs
+
+#Returns the (bands, rows) with bands*rows <= k whose S-curve 1 - (1 - s^r)^b best separates Jaccard
+#measures s below and above threshold, minimizing fp_weight times the area under the curve for
+#s < threshold (false positives) plus fn_weight times the area above it for s > threshold (false negatives)
+def lsh_params(k, threshold, fp_weight=0.5, fn_weight=0.5):
+    s = np.linspace(0, 1, 1001)
+    ds = s[1] - s[0]
+    below = s < threshold
+    best, best_err = (1, k), np.inf
+    for b in range(1, k+1):
+        for r in range(1, k//b + 1):
+            prob = 1 - (1 - s**r)**b
+            err = (fp_weight*np.sum(prob[below]) + fn_weight*np.sum(1 - prob[~below]))*ds
+            if err < best_err:
+                best, best_err = (b, r), err
+    return best
+
 print ('Class Loaded')
 
 
@@ -355,9 +1165,112 @@ print ('Class Loaded')
 # </ol>
 
 
+# Below is a class that measures how good the normal approximation is, for single (n, p) pairs or whole grids of them. The binomial PMF is computed in log space, since $\binom{n}{x}$ alone overflows a float long before $n = 10^7$, and only over the window $\mu \pm$ width$\cdot\sigma$, outside of which both distributions have negligible mass. For each pair it reports the largest error of the CDF approximation, $\max_x |F(x) - \Phi(\frac{x-\mu}{\sigma})|$, the same with the continuity correction $\Phi(\frac{x+0.5-\mu}{\sigma})$, and the total variation distance $\frac{1}{2}\sum_x |p_X(x) - q(x)|$, where $q(x)$ is either the normal PDF at $x$ or, with the continuity correction, the normal probability of $[x-0.5, x+0.5]$.
+
+
+class BinomialNormalApprox:
+    METRICS = ('cdf_err', 'cdf_err_cc', 'tv', 'tv_cc')
+    
+    #width is the half width of the evaluation window in standard deviations; block bounds the number of
+    #array elements evaluated at once
+    def __init__(self, width=8, block=1<<21):
+        self.width = width
+        self.block = block
+        self.cache = {}  # (n, p) -> values of the METRICS, so repeated cells are computed once
+    
+    #Returns the window [lo, hi] of values of X evaluated for Binomial(n, p)
+    def window(self, n, p):
+        mu, sigma = n*p, np.sqrt(n*p*(1-p))
+        return max(0, int(np.floor(mu - self.width*sigma))), min(n, int(np.ceil(mu + self.width*sigma)))
+    
+    #Returns (x, binomial pmf, normal pdf) over the window of Binomial(n, p), e.g. for plotting the two
+    def pmf(self, n, p):
+        lo, hi = self.window(n, p)
+        x = np.arange(lo, hi+1)
+        return x, np.exp(st.binom.logpmf(x, n, p)), st.norm.pdf(x, n*p, np.sqrt(n*p*(1-p)))
+    
+    #Returns a dict of the METRICS for Binomial(n, p)
+    def cell(self, n, p):
+        return {name: a[0,0] for name, a in self.grid([n], [p]).items()}
+    
+    #Returns a dict mapping each of the METRICS to an array of shape (len(ns), len(ps)) over the grid
+    def grid(self, ns, ps):
+        cells = [(int(n), float(p)) for n in ns for p in ps]
+        for n, p in cells:
+            if n < 1 or not 0 < p < 1:
+                raise ValueError('Need n >= 1 and 0 < p < 1, got n=%r, p=%r' % (n, p))
+        todo = sorted(set(c for c in cells if c not in self.cache), key=self.__length__)
+        start = 0
+        while start < len(todo):  # Cells sorted by window length, so each batch has little padding
+            stop = start + 1
+            while stop < len(todo) and (stop - start + 1)*self.__length__(todo[stop]) <= self.block:
+                stop += 1
+            self.__compute__(todo[start:stop])
+            start = stop
+        values = np.array([self.cache[c] for c in cells]).reshape(len(ns), len(ps), len(self.METRICS))
+        return {name: values[:,:,i] for i, name in enumerate(self.METRICS)}
+    
+    #Number of values of X in the window of a cell
+    def __length__(self, cell):
+        lo, hi = self.window(*cell)
+        return hi - lo + 1
+    
+    #Computes the METRICS of a list of cells together over a (cells, window length) array and caches them
+    def __compute__(self, cells):
+        n = np.array([c[0] for c in cells], dtype=float)[:,None]
+        p = np.array([c[1] for c in cells])[:,None]
+        lo, hi = np.array([self.window(*c) for c in cells]).T[:,:,None]
+        x = lo + np.arange(np.max(hi - lo) + 1)[None,:]
+        inside = x <= hi  # Rows are padded to the longest window
+        mu, sigma = n*p, np.sqrt(n*p*(1-p))
+        
+        # log of the binomial pmf, using log C(n, x) = -log(n+1) - log B(n-x+1, x+1)
+        logpmf = -np.log1p(n) - sps.betaln(n - x + 1, x + 1) + x*np.log(p) + (n - x)*np.log1p(-p)
+        pmf = np.where(inside, np.exp(logpmf), 0)
+        below = st.binom.cdf(lo - 1, n, p)[:,0]  # P{X < lo}
+        above = st.binom.sf(hi, n, p)[:,0]       # P{X > hi}
+        cdf = below[:,None] + np.cumsum(pmf, axis=1)
+        
+        z, h = (x - mu)/sigma, 0.5/sigma
+        phi, phi_up, phi_down = sps.ndtr(z), sps.ndtr(z + h), sps.ndtr(z - h)  # Normal CDF at x, x+0.5, x-0.5
+        
+        def cdf_err(normal_cdf, shift):
+            err = np.max(np.where(inside, np.abs(cdf - normal_cdf), 0), axis=1)
+            # Outside the window both CDFs are monotone, so the error there is at most the larger tail
+            phi_below = sps.ndtr((lo - 1 + shift - mu)/sigma)[:,0]
+            phi_above = sps.ndtr((mu - hi - shift)/sigma)[:,0]
+            return np.maximum(err, np.maximum.reduce([below, phi_below, above, phi_above]))
+        
+        #Sum of the normal pdf at start, start+step, start+2*step, ... for the rows picked by the mask
+        def pdf_tail(start, step, rows):
+            s, m = sigma[rows], mu[rows]
+            t = start[rows] + step*np.arange(int(np.ceil(40*np.max(s, initial=0))) + 1)[None,:]
+            return np.sum(np.exp(-((t - m)/s)**2/2), axis=1)/(s[:,0]*np.sqrt(2*np.pi))
+        
+        # Where the window truncates the support, the mass of both distributions beyond it bounds what it
+        # adds to the total variation. Where it stops at 0 or n the binomial has no mass beyond, so the
+        # normal term is exact: its probability beyond -0.5 or n+0.5 with the continuity correction and
+        # its pdf summed over the integers beyond without
+        tail_lo = sps.ndtr((lo - 0.5 - mu)/sigma)[:,0]
+        tail_hi = sps.ndtr((mu - hi - 0.5)/sigma)[:,0]
+        tails_cc = below + above + tail_lo + tail_hi
+        clip_lo, clip_hi = lo[:,0] == 0, hi[:,0] == n[:,0]
+        tail_lo[clip_lo] = pdf_tail(lo - 1, -1, clip_lo)
+        tail_hi[clip_hi] = pdf_tail(hi + 1, 1, clip_hi)
+        tails = below + above + tail_lo + tail_hi
+        q = np.exp(-z*z/2)/(sigma*np.sqrt(2*np.pi))  # Normal pdf at x
+        tv = 0.5*(np.sum(np.where(inside, np.abs(pmf - q), 0), axis=1) + tails)
+        tv_cc = 0.5*(np.sum(np.where(inside, np.abs(pmf - (phi_up - phi_down)), 0), axis=1) + tails_cc)
+        
+        for c, row in zip(cells, zip(cdf_err(phi, 0), cdf_err(phi_up, 0.5), tv, tv_cc)):
+            self.cache[c] = tuple(float(v) for v in row)
+
+print ('Class Loaded')
+
+
 # Your code here
 
 
 # **<SPAN style="BACKGROUND-COLOR: #C0C0C0">End of Problem 3</SPAN>**
 
-take a deep breadth and work this lab out step by step.
\ No newline at end of file
+# take a deep breadth and work this lab out step by step.